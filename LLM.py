@@ -51,6 +51,7 @@ def main():
             continue
         if question.lower() in ("quit", "exit", "q"):
             print("Goodbye!")
+            engine.shutdown()
             break
 
         try:
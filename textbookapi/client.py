@@ -17,10 +17,10 @@ Usage:
         print(token, end="", flush=True)
 """
 
-import json
 from typing import Generator, Optional
 
 import httpx
+import orjson
 
 
 class textbookapiError(Exception):
@@ -74,9 +74,15 @@ class _BookClient:
     ):
         self.base_url = base_url.rstrip("/")
         self._client = httpx.Client(
+            http2=True,
             base_url=self.base_url,
             headers={"Authorization": f"Bearer {api_key}"},
             timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=100,
+                max_keepalive_connections=20,
+                keepalive_expiry=300.0,
+            ),
         )
 
     def ask(
@@ -125,7 +131,7 @@ class _BookClient:
                 data_str = line[6:]
                 if data_str == "[DONE]":
                     break
-                chunk = json.loads(data_str)
+                chunk = orjson.loads(data_str)
                 if "error" in chunk:
                     raise textbookapiError(500, chunk["error"])
                 delta = chunk.get("delta", "")
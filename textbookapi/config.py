@@ -36,12 +36,24 @@ class RAGConfig:
 
     # Embeddings
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_backend: str = "onnx"  # CPU only: "torch", "onnx" or "openvino"
+    embedding_model_file: str = "onnx/model_qint8_avx512_vnni.onnx"  # ignored for "torch"
+    index_dtype: str = "int8"  # "float32" (exact), "float16" or "int8" (scalar-quantized)
+    brute_force_max_chunks: int = 5000  # at or below this, search in NumPy instead of FAISS
+    hnsw_min_chunks: int = 5000  # above this, FAISS uses an approximate HNSW graph
 
     # Chunking
     chunk_size: int = 1000
     chunk_overlap: int = 200
     top_k: int = 3
 
+    # Reuse a cached answer when a new question's embedding is this similar
+    semantic_cache_threshold: float = 0.92
+    semantic_cache_size: int = 1024  # oldest entries are evicted first
+    # Exact-match answer cache (normalized question string)
+    exact_cache_size: int = 1024
+    exact_cache_ttl: int = 1800  # seconds
+
     # Book (set per-engine)
     book_title: str = ""
     pdf_path: str = ""
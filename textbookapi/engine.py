@@ -2,18 +2,31 @@
 
 import os
 import json
-import hashlib
+import asyncio
+import mmap
 import pickle
 import logging
-from typing import Generator
-
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, AsyncGenerator, Generator
+
+import numpy as np
+import orjson
 import pymupdf
 import faiss
+import httpx
 import requests
-from sentence_transformers import SentenceTransformer
+import xxhash
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
 
 from .config import RAGConfig
 
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
 logger = logging.getLogger("textbookapi.engine")
 
 
@@ -23,16 +36,70 @@ class RAGEngineError(Exception):
 
 # ── PDF Extraction 
 
+def _cpu_count() -> int:
+    """CPUs this process may run on, honouring affinity masks (taskset, cpusets)."""
+    if hasattr(os, "process_cpu_count"):  # Python 3.13+
+        return os.process_cpu_count() or 1
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Below this many pages per worker, process start-up costs more than it saves
+_MIN_PAGES_PER_WORKER = 32
+
+# One pool of at most _cpu_count() workers, shared by books extracted concurrently
+_pdf_pool: ProcessPoolExecutor | None = None
+_pdf_pool_users = 0
+_pdf_pool_lock = threading.Lock()
+
+
+@contextmanager
+def _pdf_workers():
+    """Borrow the shared extraction pool; the last concurrent user shuts it down."""
+    global _pdf_pool, _pdf_pool_users
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            # spawn, not fork: callers may run in a thread alongside torch/FAISS/uvicorn threads
+            _pdf_pool = ProcessPoolExecutor(
+                max_workers=_cpu_count(), mp_context=multiprocessing.get_context("spawn")
+            )
+        _pdf_pool_users += 1
+        pool = _pdf_pool
+    try:
+        yield pool
+    finally:
+        with _pdf_pool_lock:
+            _pdf_pool_users -= 1
+            if _pdf_pool_users == 0:
+                _pdf_pool = None
+                pool.shutdown()
+
+
+def _extract_range(pdf_path: str, lo: int, hi: int) -> str:
+    """Extract pages [lo, hi) with a private document handle (runs in a worker)."""
+    with pymupdf.open(pdf_path) as doc:
+        return "".join(doc[i].get_text() for i in range(lo, hi))
+
+
 def extract_text_from_pdf(pdf_path: str) -> str:
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"PDF not found: {pdf_path}")
 
-    doc = pymupdf.open(pdf_path)
-    num_pages = len(doc)
-    pages = [doc[i].get_text() for i in range(num_pages)]
-    doc.close()
+    with pymupdf.open(pdf_path) as doc:
+        num_pages = len(doc)
+
+    # MuPDF handles are not thread-safe, so shard contiguous page ranges across processes
+    workers = min(_cpu_count(), num_pages // _MIN_PAGES_PER_WORKER)
+    if workers <= 1:
+        text = _extract_range(pdf_path, 0, num_pages)
+    else:
+        step = -(-num_pages // workers)
+        bounds = [(lo, min(lo + step, num_pages)) for lo in range(0, num_pages, step)]
+        with _pdf_workers() as pool:
+            futures = [pool.submit(_extract_range, pdf_path, lo, hi) for lo, hi in bounds]
+            text = "".join(f.result() for f in futures)
 
-    text = "".join(pages)
     logger.info(f"Extracted {len(text):,} chars from {num_pages} pages")
     return text
 
@@ -40,19 +107,22 @@ def extract_text_from_pdf(pdf_path: str) -> str:
 # ── Chunking 
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> list[str]:
+    # Positions of every '.' and '\n', found in one vectorized pass. UTF-32
+    # gives one code unit per character, so indices match str offsets;
+    # surrogatepass keeps lone surrogates (seen in some PDF text) encodable.
+    codes = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    breaks = np.flatnonzero((codes == 0x2E) | (codes == 0x0A))
+
     chunks = []
     start = 0
     while start < len(text):
         end = start + chunk_size
-        chunk = text[start:end]
         if end < len(text):
-            last_period = chunk.rfind(".")
-            last_newline = chunk.rfind("\n")
-            break_point = max(last_period, last_newline)
-            if break_point > chunk_size // 2:
-                chunk = chunk[: break_point + 1]
-                end = start + break_point + 1
-        chunk = chunk.strip()
+            # Last delimiter inside text[start:end]
+            i = np.searchsorted(breaks, end) - 1
+            if i >= 0 and breaks[i] - start > chunk_size // 2:
+                end = int(breaks[i]) + 1
+        chunk = text[start:end].strip()
         if len(chunk) > 50:
             chunks.append(chunk)
         start = end - overlap
@@ -64,84 +134,394 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> list[st
 # ── Vector Store 
 
 def _pdf_hash(pdf_path: str) -> str:
-    h = hashlib.md5()
-    with open(pdf_path, "rb") as f:
-        h.update(f.read(65536))
-        f.seek(0, 2)
-        size = f.tell()
-        h.update(str(size).encode())
-        if size > 65536:
-            f.seek(-65536, 2)
-            h.update(f.read(65536))
-    return h.hexdigest()
+    h = xxhash.xxh3_64()
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        # Hash straight out of the page cache; memoryview slices avoid copies
+        with memoryview(mm) as mv:
+            size = len(mv)
+            h.update(mv[:65536])
+            h.update(str(size).encode())
+            if size > 65536:
+                h.update(mv[-65536:])
+    # Prefixed so keys never collide with older MD5-named cache files
+    return f"xxh3_{h.hexdigest()}"
+
+
+class _ChunkView:
+    """
+    Read-only sequence of chunk texts stored as one UTF-8 buffer plus offsets.
+    chunks[i] decodes buf[offsets[i]:offsets[i + 1]] on demand.
+    """
+
+    def __init__(self, buf, offsets):
+        self._buf = memoryview(buf)
+        self._offsets = offsets
+
+    @classmethod
+    def from_list(cls, chunks: list[str]) -> "_ChunkView":
+        encoded = [c.encode("utf-8") for c in chunks]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(b"".join(encoded), offsets)
+
+    @classmethod
+    def load(cls, buf_file: str, offsets_file: str) -> "_ChunkView":
+        offsets = np.load(offsets_file, mmap_mode="r")
+        if os.path.getsize(buf_file) == 0:
+            return cls(b"", offsets)
+        return cls(np.memmap(buf_file, dtype=np.uint8, mode="r"), offsets)
+
+    def save(self, buf_file: str, offsets_file: str):
+        with open(buf_file, "wb") as f:
+            f.write(self._buf)
+        np.save(offsets_file, self._offsets)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i) -> str:
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        return str(self._buf[self._offsets[i]:self._offsets[i + 1]], "utf-8")
+
+
+# Scalar quantizers for the stored vectors; "float32" keeps an exact IndexFlatIP
+_INDEX_QUANTIZERS = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+# HNSW graph parameters for large books (approximate search)
+_HNSW_M = 32
+_HNSW_EF_CONSTRUCTION = 80
+_HNSW_EF_SEARCH = 64
+
+
+def _build_index(embeddings, index_dtype: str, hnsw: bool = False):
+    """Build an inner-product FAISS index over L2-normalized embeddings."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    d = embeddings.shape[1]
+    metric = faiss.METRIC_INNER_PRODUCT
+    if index_dtype != "float32" and index_dtype not in _INDEX_QUANTIZERS:
+        raise RAGEngineError(f"Unsupported index_dtype: {index_dtype}")
+
+    if hnsw:
+        if index_dtype == "float32":
+            index = faiss.IndexHNSWFlat(d, _HNSW_M, metric)
+        else:
+            index = faiss.IndexHNSWSQ(d, _INDEX_QUANTIZERS[index_dtype], _HNSW_M, metric)
+        index.hnsw.efConstruction = _HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = _HNSW_EF_SEARCH
+    elif index_dtype == "float32":
+        index = faiss.IndexFlatIP(d)
+    else:
+        index = faiss.IndexScalarQuantizer(d, _INDEX_QUANTIZERS[index_dtype], metric)
+
+    if not index.is_trained:
+        index.train(embeddings)
+    index.add(embeddings)
+    return index
+
+
+def _embedding_device() -> str:
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def resolve_embedding_backend(backend: str, model_file: str) -> tuple[str, str]:
+    """
+    The (backend, model_file) that will actually run on this machine.
+    A GPU beats the CPU-tuned int8 ONNX export, so accelerators always use torch.
+    """
+    if backend == "torch" or _embedding_device() != "cpu":
+        return "torch", ""
+    return backend, model_file
+
+
+# Loaded embedding models keyed by (name, backend, model_file), shared by every VectorStore
+_embedding_models: dict[tuple[str, str, str], "SentenceTransformer"] = {}
+_embedding_models_lock = threading.Lock()
+
+
+def get_embedding_model(name: str, backend: str, model_file: str) -> "SentenceTransformer":
+    """Return the process-wide instance of an embedding model, loading it once."""
+    backend, model_file = resolve_embedding_backend(backend, model_file)
+    key = (name, backend, model_file)
+    with _embedding_models_lock:
+        if key not in _embedding_models:
+            logger.info(f"Loading embedding model: {name} ({backend})")
+            _embedding_models[key] = _load_embedding_model(name, backend, model_file)
+        return _embedding_models[key]
+
+
+def _load_embedding_model(name: str, backend: str, model_file: str) -> "SentenceTransformer":
+    # torch / sentence_transformers are imported here rather than at module level so
+    # spawned PDF extraction workers, which re-import this module, stay cheap to start
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        device = _embedding_device()
+        logger.info(f"Embedding on {device}")
+        if device == "cpu":
+            torch.set_num_threads(_cpu_count())
+        return SentenceTransformer(name, device=device)
+    # ONNX Runtime / OpenVINO; model_file picks e.g. a pre-quantized int8 export
+    model_kwargs = {"file_name": model_file} if model_file else None
+    return SentenceTransformer(name, device="cpu", backend=backend, model_kwargs=model_kwargs)
 
 
 class VectorStore:
-    def __init__(self, embedding_model: str, cache_dir: str):
-        logger.info(f"Loading embedding model: {embedding_model}")
-        self.model = SentenceTransformer(embedding_model)
+    def __init__(
+        self,
+        embedding_model: str,
+        cache_dir: str,
+        index_dtype: str = "int8",
+        brute_force_max_chunks: int = 5000,
+        hnsw_min_chunks: int = 5000,
+        embedding_backend: str = "torch",
+        embedding_model_file: str = "",
+        query_cache_size: int = 1024,
+        query_cache_key: str = "",
+    ):
+        self.model = get_embedding_model(embedding_model, embedding_backend, embedding_model_file)
+        # Vectors from different models/exports are not comparable, so they get separate caches
+        backend, model_file = resolve_embedding_backend(embedding_backend, embedding_model_file)
+        model_id = f"{embedding_model}|{backend}|{model_file}"
+        self._model_key = xxhash.xxh3_64_hexdigest(model_id.encode())
         self.cache_dir = cache_dir
+        self.index_dtype = index_dtype
+        self.brute_force_max_chunks = brute_force_max_chunks
+        self.hnsw_min_chunks = hnsw_min_chunks
         self.index = None
-        self.chunks: list[str] = []
-
-    def load_or_build(self, chunks: list[str], pdf_path: str):
+        self.embeddings = None
+        self._emb_matrix = None
+        self.chunks = _ChunkView.from_list([])
+
+        # Semantic query cache: normalized question embeddings -> past answers (FIFO-bounded)
+        self.qcache_size = query_cache_size
+        # Fingerprint of the generation settings; a persisted cache made under others is dropped
+        self.qcache_key = query_cache_key
+        dim = self.model.get_sentence_embedding_dimension()
+        self.qcache_index = faiss.IndexFlatIP(dim)
+        self.qcache_embs: list = []
+        self.qcache_top_k: list[int] = []
+        self.qcache_answers: list[str] = []
+        self.qcache_sources: list[list[tuple[str, float]]] = []
+        self._qcache_file = ""
+        self._qcache_lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """Number of indexed chunk vectors."""
+        return len(self.chunks)
+
+    def load_or_build(self, pdf_path: str, chunk_size: int, chunk_overlap: int):
+        """
+        Load the book's chunks and vectors from cache_dir, or extract, chunk and embed
+        the PDF when no cache matches. A warm start only hashes the PDF, never parses it.
+        """
         os.makedirs(self.cache_dir, exist_ok=True)
-        cache_file = os.path.join(self.cache_dir, f"index_{_pdf_hash(pdf_path)}.pkl")
-
-        if os.path.exists(cache_file):
+        pdf_hash = _pdf_hash(pdf_path)
+        emb_key = f"{pdf_hash}_{chunk_size}_{chunk_overlap}_{self._model_key}"
+        emb_file = os.path.join(self.cache_dir, f"emb_{emb_key}.npy")
+        index_prefix = os.path.join(self.cache_dir, f"idx_{emb_key}_{self.index_dtype}")
+        # Keyed like the embeddings so a rebuild under another model never leaves the
+        # two out of step
+        chunks_file = os.path.join(self.cache_dir, f"chunks_{emb_key}.bin")
+        offsets_file = os.path.join(self.cache_dir, f"offsets_{emb_key}.npy")
+        self._qcache_file = os.path.join(self.cache_dir, f"qcache_{emb_key}.pkl")
+        self._load_query_cache()
+
+        if all(os.path.exists(p) for p in (emb_file, chunks_file, offsets_file)):
             logger.info("Loading cached index from disk")
-            with open(cache_file, "rb") as f:
-                data = pickle.load(f)
-            self.chunks = data["chunks"]
-            embeddings = data["embeddings"]
-            self.index = faiss.IndexFlatIP(embeddings.shape[1])
-            self.index.add(embeddings)
-            logger.info(f"Loaded {self.index.ntotal} vectors from cache")
+            self.chunks = _ChunkView.load(chunks_file, offsets_file)
+            self.embeddings = np.load(emb_file, mmap_mode="r")
+            self._init_search(self.embeddings, index_prefix)
+            logger.info(f"Loaded {self.size} vectors from cache")
             return
 
-        self.chunks = chunks
+        chunks = chunk_text(extract_text_from_pdf(pdf_path), chunk_size, chunk_overlap)
+        self.chunks = _ChunkView.from_list(chunks)
         logger.info("Generating embeddings...")
         embeddings = self.model.encode(
             chunks, batch_size=128, show_progress_bar=True, convert_to_numpy=True
         ).astype("float32")
         faiss.normalize_L2(embeddings)
 
-        self.index = faiss.IndexFlatIP(embeddings.shape[1])
-        self.index.add(embeddings)
-        logger.info(f"FAISS index built: {self.index.ntotal} vectors")
-
-        with open(cache_file, "wb") as f:
-            pickle.dump({"chunks": chunks, "embeddings": embeddings}, f)
+        # fp16 is ample for ranking unit vectors and halves the on-disk cache
+        self.embeddings = embeddings.astype(np.float16)
+        np.save(emb_file, self.embeddings)
+        self._init_search(embeddings, index_prefix)
+        self.chunks.save(chunks_file, offsets_file)
         logger.info("Index cached to disk")
 
+    def _init_search(self, embeddings, index_prefix: str):
+        """
+        Brute-force small books in NumPy; load or build a FAISS index for large ones,
+        using HNSW above hnsw_min_chunks.
+        """
+        if len(embeddings) <= self.brute_force_max_chunks:
+            self.index = None
+            self._emb_matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+            logger.info(f"Using exact NumPy search over {len(embeddings)} vectors")
+            return
+
+        self._emb_matrix = None
+        hnsw = len(embeddings) > self.hnsw_min_chunks
+        index_file = f"{index_prefix}_{'hnsw' if hnsw else 'flat'}.faiss"
+        if os.path.exists(index_file):
+            self.index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP)
+            return
+        self.index = _build_index(embeddings, self.index_dtype, hnsw)
+        faiss.write_index(self.index, index_file)
+        kind = "HNSW" if hnsw else "flat"
+        logger.info(f"FAISS {kind} index built: {self.index.ntotal} vectors ({self.index_dtype})")
+
+    def embed_query(self, query: str):
+        """Encode a query as a (1, dim) L2-normalized float32 matrix."""
+        return self.model.encode(
+            [query], normalize_embeddings=True, convert_to_numpy=True
+        ).astype("float32")
+
     def search(self, query: str, top_k: int = 3) -> list[tuple[str, float]]:
-        query_emb = self.model.encode([query], convert_to_numpy=True).astype("float32")
-        faiss.normalize_L2(query_emb)
+        return self.search_embedding(self.embed_query(query), top_k)
+
+    def search_embedding(self, query_emb, top_k: int = 3) -> list[tuple[str, float]]:
+        if self.index is None:
+            # One GEMV plus a partial sort beats FAISS dispatch for small N
+            scores = self._emb_matrix @ query_emb[0]
+            k = min(top_k, len(scores))
+            if k == 0:
+                return []
+            top = np.argpartition(scores, -k)[-k:]
+            top = top[np.argsort(-scores[top])]
+            return [(self.chunks[i], float(scores[i])) for i in top]
+
         scores, indices = self.index.search(query_emb, top_k)
         return [
             (self.chunks[idx], float(score))
             for score, idx in zip(scores[0], indices[0])
-            if idx < len(self.chunks)
+            if 0 <= idx < len(self.chunks)  # FAISS pads missing hits with -1
         ]
 
+    # ── Semantic query cache
+
+    def lookup_answer(self, query_emb, top_k: int, threshold: float):
+        """
+        Return (answer, sources) of the most similar cached question above threshold
+        that was answered with the same top_k, or None.
+        """
+        with self._qcache_lock:
+            if self.qcache_index.ntotal == 0:
+                return None
+            _, scores, indices = self.qcache_index.range_search(query_emb, threshold)
+            for j in np.argsort(-scores):
+                i = int(indices[j])
+                if self.qcache_top_k[i] == top_k:
+                    return self.qcache_answers[i], self.qcache_sources[i]
+            return None
+
+    def cache_answer(self, query_emb, top_k: int, answer: str, sources: list[tuple[str, float]]):
+        with self._qcache_lock:
+            if self.qcache_size <= 0:
+                return
+            if self.qcache_index.ntotal >= self.qcache_size:
+                # FIFO eviction; IndexFlat renumbers the remaining ids, matching the list pops
+                self.qcache_index.remove_ids(np.array([0], dtype=np.int64))
+                del self.qcache_embs[0], self.qcache_top_k[0]
+                del self.qcache_answers[0], self.qcache_sources[0]
+            self.qcache_index.add(query_emb)
+            self.qcache_embs.append(query_emb[0])
+            self.qcache_top_k.append(top_k)
+            self.qcache_answers.append(answer)
+            self.qcache_sources.append(sources)
+
+    def _load_query_cache(self):
+        if not os.path.exists(self._qcache_file):
+            return
+        with open(self._qcache_file, "rb") as f:
+            data = pickle.load(f)
+        if data.get("key") != self.qcache_key:
+            logger.info("Generation settings changed, discarding cached answers")
+            return
+        entries = zip(data["embeddings"], data["top_k"], data["answers"], data["sources"])
+        for emb, top_k, answer, sources in entries:
+            self.cache_answer(emb.reshape(1, -1), top_k, answer, sources)
+        logger.info(f"Loaded {len(self.qcache_answers)} cached answers")
+
+    def save_query_cache(self):
+        if not self._qcache_file:
+            return
+        with self._qcache_lock:
+            data = {
+                "key": self.qcache_key,
+                "embeddings": list(self.qcache_embs),
+                "top_k": list(self.qcache_top_k),
+                "answers": list(self.qcache_answers),
+                "sources": list(self.qcache_sources),
+            }
+        with open(self._qcache_file, "wb") as f:
+            pickle.dump(data, f)
+        logger.info(f"Saved {len(data['answers'])} cached answers")
+
+
+
+# ── Ollama 
+
+# One pooled session so every call to Ollama reuses an open TCP connection
+_ollama_session = requests.Session()
+_ollama_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# Shared by every engine's async streaming path (see RAGEngine.aquery)
+_ollama_async_client: httpx.AsyncClient | None = None
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Return the shared async client, (re)creating it after close_http_clients()."""
+    global _ollama_async_client
+    if _ollama_async_client is None or _ollama_async_client.is_closed:
+        _ollama_async_client = httpx.AsyncClient(
+            timeout=120,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return _ollama_async_client
+
+
+async def close_http_clients():
+    """Close pooled Ollama connections. Call once on server shutdown."""
+    global _ollama_async_client
+    if _ollama_async_client is not None:
+        await _ollama_async_client.aclose()
+        _ollama_async_client = None
+    _ollama_session.close()
 
 
 def _check_ollama(base_url: str) -> bool:
     try:
-        return requests.get(f"{base_url}/api/tags", timeout=5).status_code == 200
+        return _ollama_session.get(f"{base_url}/api/tags", timeout=5).status_code == 200
     except requests.ConnectionError:
         return False
 
 
 def _ensure_model(base_url: str, model: str):
-    resp = requests.get(f"{base_url}/api/tags", timeout=10)
+    resp = _ollama_session.get(f"{base_url}/api/tags", timeout=10)
     models = [m["name"] for m in resp.json().get("models", [])]
     if any(model in m for m in models):
         logger.info(f"Model '{model}' available")
         return
 
     logger.info(f"Pulling model '{model}'...")
-    pull = requests.post(
+    pull = _ollama_session.post(
         f"{base_url}/api/pull", json={"name": model}, stream=True, timeout=600
     )
     for line in pull.iter_lines():
@@ -151,12 +531,21 @@ def _ensure_model(base_url: str, model: str):
     logger.info(f"Model '{model}' ready")
 
 
-def _warmup_model(base_url: str, model: str):
+def _warmup_model(base_url: str, model: str, system: str, num_ctx: int):
+    """Load the model and prefill the system prompt into Ollama's prompt cache."""
     logger.info("Warming up LLM...")
     try:
-        requests.post(
+        _ollama_session.post(
             f"{base_url}/api/generate",
-            json={"model": model, "prompt": "Hi", "options": {"num_predict": 1}, "keep_alive": "30m"},
+            json={
+                "model": model,
+                "prompt": "Hi",
+                "system": system,
+                "stream": False,
+                # Same num_ctx as queries, otherwise Ollama reloads the model
+                "options": {"num_predict": 1, "num_ctx": num_ctx},
+                "keep_alive": "30m",
+            },
             timeout=60,
         )
         logger.info("Model loaded into memory")
@@ -164,6 +553,14 @@ def _warmup_model(base_url: str, model: str):
         logger.warning("Warmup failed, first query may be slow")
 
 
+def _estimate_num_keep(system: str) -> int:
+    """
+    Upper-bound token count of the system prompt plus chat-template framing.
+    Deliberately static: Ollama's prompt_eval_count only counts uncached tokens.
+    """
+    return len(system) // 3 + 16
+
+
 # ── RAG Engine 
 
 class RAGEngine:
@@ -173,6 +570,14 @@ class RAGEngine:
         self.config = config
         self.store: VectorStore | None = None
         self.ready = False
+        # Byte-identical across requests so Ollama can reuse its KV cache for the prefix
+        self._system_prompt = self._build_system_prompt()
+        self._num_keep = _estimate_num_keep(self._system_prompt)
+        # Exact-match tier in front of the semantic cache, keyed by (question, top_k)
+        self._exact: TTLCache = TTLCache(
+            maxsize=max(config.exact_cache_size, 0), ttl=config.exact_cache_ttl
+        )
+        self._exact_lock = threading.Lock()
 
     def initialize(self):
         """Load PDF, build index, warm up model. Call once at startup."""
@@ -185,13 +590,20 @@ class RAGEngine:
             )
 
         _ensure_model(cfg.ollama_base_url, cfg.model_name)
-        _warmup_model(cfg.ollama_base_url, cfg.model_name)
-
-        text = extract_text_from_pdf(cfg.pdf_path)
-        chunks = chunk_text(text, cfg.chunk_size, cfg.chunk_overlap)
-
-        self.store = VectorStore(cfg.embedding_model, cfg.cache_dir)
-        self.store.load_or_build(chunks, cfg.pdf_path)
+        _warmup_model(cfg.ollama_base_url, cfg.model_name, self._system_prompt, cfg.context_window)
+
+        self.store = VectorStore(
+            cfg.embedding_model,
+            cfg.cache_dir,
+            cfg.index_dtype,
+            cfg.brute_force_max_chunks,
+            cfg.hnsw_min_chunks,
+            cfg.embedding_backend,
+            cfg.embedding_model_file,
+            query_cache_size=cfg.semantic_cache_size,
+            query_cache_key=self._answer_fingerprint(),
+        )
+        self.store.load_or_build(cfg.pdf_path, cfg.chunk_size, cfg.chunk_overlap)
         self.ready = True
         logger.info("RAG engine ready")
 
@@ -200,25 +612,97 @@ class RAGEngine:
         Ask a question. Returns (answer, results) or (token_generator, results).
         results is a list of (chunk, score) tuples.
         """
+        cached, results, key, query_emb, context = self._retrieve(question, top_k)
+        if cached is not None:
+            return (iter([cached]) if stream else cached), results
+
+        if stream:
+            return self._stream_and_cache(question, context, key, query_emb, results), results
+        else:
+            answer = "".join(self._stream(question, context))
+            self._remember(key, query_emb, answer, results)
+            return answer, results
+
+    async def aquery(self, question: str, top_k: int | None = None):
+        """
+        Async streaming variant of query(). Returns (async_token_generator, results).
+        Retrieval runs in a worker thread; generation streams natively on the event loop.
+        """
+        cached, results, key, query_emb, context = await asyncio.to_thread(
+            self._retrieve, question, top_k
+        )
+        if cached is not None:
+            return _areplay(cached), results
+        return self._astream_and_cache(question, context, key, query_emb, results), results
+
+    def shutdown(self):
+        """Persist the query cache. Call once on exit."""
+        if self.store is not None:
+            self.store.save_query_cache()
+
+    def _retrieve(self, question: str, top_k: int | None):
+        """
+        Resolve a question against the answer caches, falling back to vector search.
+        Returns (cached_answer, results, cache_key, query_embedding, context).
+        """
         if not self.ready:
             raise RAGEngineError("Engine not initialized")
 
         k = top_k or self.config.top_k
-        results = self.store.search(question, k)
+        key = (question.strip().lower(), k)
+        with self._exact_lock:
+            cached = self._exact.get(key)
+
+        query_emb = None
+        if cached is None:
+            query_emb = self.store.embed_query(question)
+            cached = self.store.lookup_answer(query_emb, k, self.config.semantic_cache_threshold)
+        if cached is not None:
+            answer, results = cached
+            return answer, results, key, query_emb, ""
+
+        results = self.store.search_embedding(query_emb, k)
         context = "\n\n".join(chunk for chunk, _ in results)
+        return None, results, key, query_emb, context
+
+    def _stream_and_cache(self, question: str, context: str, key: tuple, query_emb, results):
+        """Stream tokens and cache the full answer once generation completes."""
+        tokens = []
+        for token in self._stream(question, context):
+            tokens.append(token)
+            yield token
+        self._remember(key, query_emb, "".join(tokens), results)
+
+    async def _astream_and_cache(self, question: str, context: str, key: tuple, query_emb, results):
+        tokens = []
+        async for token in self._astream(question, context):
+            tokens.append(token)
+            yield token
+        self._remember(key, query_emb, "".join(tokens), results)
+
+    def _remember(self, key: tuple, query_emb, answer: str, results: list[tuple[str, float]]):
+        if not answer:
+            return
+        if self._exact.maxsize > 0:  # size 0 disables the tier; TTLCache would reject the insert
+            with self._exact_lock:
+                self._exact[key] = (answer, results)
+        self.store.cache_answer(query_emb, key[1], answer, results)
 
-        if stream:
-            return self._stream(question, context), results
-        else:
-            tokens = list(self._stream(question, context))
-            return "".join(tokens), results
-
-    def _stream(self, question: str, context: str) -> Generator[str, None, None]:
-        """Yield tokens from Ollama one at a time."""
+    def _answer_fingerprint(self) -> str:
+        """Hash of every setting that shapes a generated answer, for the semantic cache."""
         cfg = self.config
+        settings = (
+            cfg.model_name,
+            self._system_prompt,
+            self._options(),
+            cfg.chunk_size,
+            cfg.chunk_overlap,
+        )
+        return xxhash.xxh3_64_hexdigest(orjson.dumps(settings, option=orjson.OPT_SORT_KEYS))
 
+    def _build_system_prompt(self) -> str:
         book_title = self.config.book_title
-        system = (
+        return (
             f"You are a helpful assistant for the book \"{book_title}\". "
             "Your job is to answer questions ONLY about this book using the provided context. "
             "Rules:\n"
@@ -230,36 +714,72 @@ class RAGEngine:
             "- Be concise and accurate."
         )
 
+    def _options(self) -> dict:
+        cfg = self.config
+        return {
+            "temperature": cfg.temperature,
+            "top_p": cfg.top_p,
+            "num_predict": cfg.max_tokens,
+            "num_ctx": cfg.context_window,
+            # Keep the system-prompt prefix when Ollama shifts the context window
+            "num_keep": self._num_keep,
+        }
+
+    def _generate_payload(self, question: str, context: str) -> dict:
         prompt = f"Context from the book:\n---\n{context}\n---\n\nUser: {question}\n\nAssistant:"
+        return {
+            "model": self.config.model_name,
+            "prompt": prompt,
+            "system": self._system_prompt,
+            "stream": True,
+            "keep_alive": "30m",
+            "options": self._options(),
+        }
 
+    def _stream(self, question: str, context: str) -> Generator[str, None, None]:
+        """Yield tokens from Ollama one at a time."""
         try:
-            resp = requests.post(
-                f"{cfg.ollama_base_url}/api/generate",
-                json={
-                    "model": cfg.model_name,
-                    "prompt": prompt,
-                    "system": system,
-                    "stream": True,
-                    "keep_alive": "30m",
-                    "options": {
-                        "temperature": cfg.temperature,
-                        "top_p": cfg.top_p,
-                        "num_predict": cfg.max_tokens,
-                        "num_ctx": cfg.context_window,
-                    },
-                },
+            with _ollama_session.post(
+                f"{self.config.ollama_base_url}/api/generate",
+                json=self._generate_payload(question, context),
                 stream=True,
                 timeout=120,
-            )
-            for line in resp.iter_lines():
-                if line:
-                    data = json.loads(line)
-                    token = data.get("response", "")
-                    if token:
-                        yield token
-                    if data.get("done", False):
-                        return
+            ) as resp:
+                # Closing returns the connection to the session pool
+                for line in resp.iter_lines():
+                    if line:
+                        data = orjson.loads(line)
+                        token = data.get("response", "")
+                        if token:
+                            yield token
+                        if data.get("done", False):
+                            return
         except requests.ConnectionError:
             raise RAGEngineError("Cannot connect to Ollama")
         except Exception as e:
             raise RAGEngineError(f"LLM query failed: {e}")
+
+    async def _astream(self, question: str, context: str) -> AsyncGenerator[str, None]:
+        """Async counterpart of _stream() on the shared httpx.AsyncClient."""
+        try:
+            async with _get_async_client().stream(
+                "POST",
+                f"{self.config.ollama_base_url}/api/generate",
+                json=self._generate_payload(question, context),
+            ) as resp:
+                async for line in resp.aiter_lines():
+                    if line:
+                        data = orjson.loads(line)
+                        token = data.get("response", "")
+                        if token:
+                            yield token
+                        if data.get("done", False):
+                            return
+        except httpx.ConnectError:
+            raise RAGEngineError("Cannot connect to Ollama")
+        except Exception as e:
+            raise RAGEngineError(f"LLM query failed: {e}")
+
+
+async def _areplay(answer: str) -> AsyncGenerator[str, None]:
+    yield answer
@@ -1,19 +1,19 @@
 """FastAPI server with OpenAI-style API endpoints."""
 
 import os
-import json
 import uuid
 import asyncio
 import logging
 from contextlib import asynccontextmanager
 
+import orjson
 import uvicorn
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 
 from .config import RAGConfig, BOOKS
-from .engine import RAGEngine, RAGEngineError
-from .models import QueryRequest, QueryResponse, StreamChunk, HealthResponse, BookStatus, Source
+from .engine import RAGEngine, RAGEngineError, close_http_clients
+from .models import QueryRequest, QueryResponse, HealthResponse, BookStatus, Source
 from .auth import APIKeyManager, require_api_key
 
 logging.basicConfig(
@@ -40,15 +40,17 @@ async def lifespan(app: FastAPI):
     key_manager = APIKeyManager(base_config.api_keys_file)
     _auth_dependency = require_api_key(key_manager)
 
-    # Initialize one engine per book
+    # Initialize one engine per book; each is independent, so build them concurrently
     for book_id in BOOKS:
         config = RAGConfig.for_book(book_id)
         logger.info(f"Initializing book: {BOOKS[book_id]['title']}")
         logger.info(f"  PDF: {config.pdf_path}")
+        engines[book_id] = RAGEngine(config)
 
-        eng = RAGEngine(config)
-        eng.initialize()
-        engines[book_id] = eng
+    # PDF extraction workers are spawned from one shared pool sized to the usable CPUs, so
+    # concurrent books neither fork under these threads nor oversubscribe the CPUs
+    await asyncio.gather(*(asyncio.to_thread(eng.initialize) for eng in engines.values()))
+    for book_id in engines:
         logger.info(f"  Book '{BOOKS[book_id]['title']}' ready.")
 
     logger.info(f"Server ready — {len(engines)} book(s) loaded.")
@@ -56,6 +58,9 @@ async def lifespan(app: FastAPI):
     yield
 
     logger.info("Shutting down.")
+    for eng in engines.values():
+        eng.shutdown()
+    await close_http_clients()
 
 
 app = FastAPI(
@@ -76,7 +81,7 @@ async def health():
         books.append(BookStatus(
             name=BOOKS[book_id]["title"],
             status="ready" if eng.ready else "initializing",
-            index_size=eng.store.index.ntotal if eng.ready else 0,
+            index_size=eng.store.size if eng.ready else 0,
         ))
 
     all_ready = all(eng.ready for eng in engines.values())
@@ -129,38 +134,22 @@ async def query(request: QueryRequest):
 async def _stream_response(request: QueryRequest, eng: RAGEngine):
     """SSE generator — yields data: {json} lines."""
     response_id = f"rag-{uuid.uuid4().hex[:12]}"
-    loop = asyncio.get_event_loop()
+    # Frames match models.StreamChunk; only the delta is encoded per token
+    prefix = f'data: {{"id":"{response_id}","delta":'
+    suffix = ',"done":false}\n\n'
 
     try:
-        token_gen, results = eng.query(
-            request.question, stream=True, top_k=request.top_k
-        )
-
-        # Bridge sync generator to async using a queue
-        q: asyncio.Queue[str | None] = asyncio.Queue()
-
-        def _produce():
-            try:
-                for token in token_gen:
-                    loop.call_soon_threadsafe(q.put_nowait, token)
-            finally:
-                loop.call_soon_threadsafe(q.put_nowait, None)
-
-        loop.run_in_executor(None, _produce)
+        token_gen, results = await eng.aquery(request.question, top_k=request.top_k)
 
-        while True:
-            token = await q.get()
-            if token is None:
-                break
-            chunk = StreamChunk(id=response_id, delta=token)
-            yield f"data: {chunk.model_dump_json()}\n\n"
+        # One frame per token, written as soon as Ollama emits it
+        async for token in token_gen:
+            yield prefix + orjson.dumps(token).decode() + suffix
 
-        done = StreamChunk(id=response_id, delta="", done=True)
-        yield f"data: {done.model_dump_json()}\n\n"
+        yield prefix + '"","done":true}\n\n'
         yield "data: [DONE]\n\n"
 
     except RAGEngineError as e:
-        yield f"data: {json.dumps({'error': str(e)})}\n\n"
+        yield f"data: {orjson.dumps({'error': str(e)}).decode()}\n\n"
 
 
 # ── Auth middleware ──────────────────────────────────────────────────────────
@@ -190,5 +179,8 @@ if __name__ == "__main__":
         "textbookapi.server:app",
         host="0.0.0.0",
         port=8000,
+        # "auto" picks uvloop/httptools when installed (uvicorn[standard]), asyncio elsewhere
+        loop="auto",
+        http="auto",
         log_level="info",
     )